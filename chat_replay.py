@@ -0,0 +1,342 @@
+"""
+Offline replay and profiling of recorded conversations.
+
+Conversations recorded by the server (see TRACE_FILE) are replayed through the servicer with
+deterministic fakes of the LLM and the web retriever, so MemoryManager, ConversationMemory and
+PromptEngine can be profiled without calling OpenAI or Tavily.
+
+Stages are measured through the servicer's _stage hook. Timings, allocations and cProfile output are
+collected in separate replay passes so the instrumentation of one does not skew the others.
+"""
+
+import argparse
+from contextlib import contextmanager
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+from typing import Any, Iterator
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# core.constants builds the default summarizer on import and requires an OpenAI key,
+# which is never used while replaying.
+os.environ.setdefault("OPENAI_API_KEY", "replay")
+
+from chat_servicer import ChatbotServicerImpl  # pylint: disable=wrong-import-position
+from chat_pb2 import ConversationalRequest, ConversationalResponse  # pylint: disable=wrong-import-position
+from core import load_trace  # pylint: disable=wrong-import-position
+
+
+class Replayer:
+    """
+    Holds the recorded turn currently being replayed.
+
+    Attributes:
+        turn (dict | None): The recorded turn shared by the fake LLM and retriever.
+    """
+
+    def __init__(self) -> None:
+        self.turn: dict | None = None
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    A chat model that streams the recorded tokens and returns the recorded summary.
+    """
+
+    replayer: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        # Non-streaming calls only come from the memory manager summarizing the conversation.
+        message = AIMessage(content=self.replayer.turn["summary"])
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        for token in self.replayer.turn["tokens"]:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class ReplayRetriever:
+    """
+    A web retriever that returns the recorded search results.
+    """
+
+    def __init__(self, replayer: Replayer) -> None:
+        self.replayer = replayer
+
+    def invoke(self, input: str) -> list[Document]:  # pylint: disable=redefined-builtin
+        """
+        Returns the recorded search results of the current turn.
+
+        Args:
+            input (str): The search query. Ignored.
+
+        Returns:
+            list[Document]: The recorded search results.
+        """
+        return [
+            Document(page_content=result["content"], metadata={"source": result["source"]})
+            for result in self.replayer.turn["search_results"]
+        ]
+
+
+class ReplayServicerImpl(ChatbotServicerImpl):
+    """
+    The chatbot servicer backed by the fake LLM and retriever, reporting its stages to a StageProfiler.
+    """
+
+    def __init__(self, replayer: Replayer, stage_profiler: "StageProfiler") -> None:
+        super().__init__(openai_api_key="replay", tavily_api_key="replay")
+        self.replayer = replayer
+        self.stage_profiler = stage_profiler
+
+    def _llm_factory(self, openai_api_key: str):
+        return ReplayChatModel(replayer=self.replayer)
+
+    def _retriever_factory(self, tavily_api_key: str):
+        return ReplayRetriever(self.replayer)
+
+    def _stage(self, name: str):
+        return self.stage_profiler.measure(name)
+
+
+class StageProfiler:
+    """
+    Collects the measurements of every stage of the servicer using a single kind of instrumentation.
+
+    Each instrumentation runs in its own replay pass so the profilers do not distort the timings.
+
+    Attributes:
+        instrumentation (str): One of INSTRUMENTATIONS.
+        stats (dict[str, dict[str, float]]): The accumulated measurements per stage.
+        profiles (dict[str, cProfile.Profile]): The cProfile profile per stage.
+        failures (list[str]): The turns that did not replay as recorded.
+    """
+
+    TIMING = "timing"
+    ALLOC = "alloc"
+    CPROFILE = "cprofile"
+    INSTRUMENTATIONS = (TIMING, ALLOC, CPROFILE)
+
+    def __init__(self, instrumentation: str = TIMING) -> None:
+        """
+        Initializes a new instance of the StageProfiler class.
+
+        Args:
+            instrumentation (str, optional): What to measure: CPU and wall time ('timing'),
+                allocations with tracemalloc ('alloc') or call profiles with cProfile ('cprofile').
+                Defaults to 'timing'.
+
+        Raises:
+            ValueError: If the instrumentation is not one of INSTRUMENTATIONS.
+        """
+        if instrumentation not in self.INSTRUMENTATIONS:
+            raise ValueError(f"Instrumentation must be one of {', '.join(self.INSTRUMENTATIONS)}")
+        self.instrumentation = instrumentation
+        self.stats: dict[str, dict[str, float]] = {}
+        self.profiles: dict[str, cProfile.Profile] = {}
+        self.failures: list[str] = []
+
+    @contextmanager
+    def measure(self, stage: str):
+        """
+        Measures the enclosed block and accounts it to the given stage.
+
+        Args:
+            stage (str): The name of the stage.
+        """
+        stats = self.stats.setdefault(
+            stage, {"calls": 0, "cpu": 0.0, "wall": 0.0, "allocated": 0, "peak": 0}
+        )
+        stats["calls"] += 1
+        match self.instrumentation:
+            case StageProfiler.TIMING:
+                start_cpu = time.process_time()
+                start_wall = time.perf_counter()
+                try:
+                    yield
+                finally:
+                    stats["wall"] += time.perf_counter() - start_wall
+                    stats["cpu"] += time.process_time() - start_cpu
+            case StageProfiler.ALLOC:
+                tracemalloc.reset_peak()
+                start_memory, _ = tracemalloc.get_traced_memory()
+                try:
+                    yield
+                finally:
+                    end_memory, peak_memory = tracemalloc.get_traced_memory()
+                    stats["allocated"] += end_memory - start_memory
+                    stats["peak"] = max(stats["peak"], peak_memory - start_memory)
+            case StageProfiler.CPROFILE:
+                if stage not in self.profiles:
+                    self.profiles[stage] = cProfile.Profile()
+                profiler = self.profiles[stage]
+                profiler.enable()
+                try:
+                    yield
+                finally:
+                    profiler.disable()
+
+    def dump_profiles(self, directory: str):
+        """
+        Writes one .prof file per stage and a combined replay.prof into the given directory.
+
+        The files are in the pstats format and can be rendered as flame graphs
+        with tools such as snakeviz or flameprof.
+
+        Args:
+            directory (str): The output directory.
+        """
+        os.makedirs(directory, exist_ok=True)
+        combined = None
+        for stage, profiler in self.profiles.items():
+            profiler.dump_stats(os.path.join(directory, f"{stage.lower()}.prof"))
+            if combined is None:
+                combined = pstats.Stats(profiler)
+            else:
+                combined.add(profiler)
+        if combined is not None:
+            combined.dump_stats(os.path.join(directory, "replay.prof"))
+
+    def __str__(self) -> str:
+        """
+        Get a table of the measurements per stage.
+
+        Returns:
+            str: The string representation of the measurements.
+        """
+        output = f"INSTRUMENTATION: {self.instrumentation}\n"
+        match self.instrumentation:
+            case StageProfiler.TIMING:
+                output += f"{'STAGE':<20}{'CALLS':>8}{'CPU (s)':>12}{'WALL (s)':>12}\n"
+                for stage, stats in self.stats.items():
+                    output += f"{stage:<20}{stats['calls']:>8}{stats['cpu']:>12.4f}{stats['wall']:>12.4f}\n"
+            case StageProfiler.ALLOC:
+                output += f"{'STAGE':<20}{'CALLS':>8}{'NET ALLOC (KiB)':>18}{'PEAK (KiB)':>14}\n"
+                for stage, stats in self.stats.items():
+                    output += (
+                        f"{stage:<20}{stats['calls']:>8}"
+                        f"{stats['allocated'] / 1024:>18.1f}{stats['peak'] / 1024:>14.1f}\n"
+                    )
+            case StageProfiler.CPROFILE:
+                output += f"{'STAGE':<20}{'CALLS':>8}\n"
+                for stage, stats in self.stats.items():
+                    output += f"{stage:<20}{stats['calls']:>8}\n"
+        output += f"FAILED TURNS: {len(self.failures)}\n"
+        for failure in self.failures:
+            output += f"  - {failure}\n"
+        return output
+
+
+def replay(turns: list[dict], stage_profiler: StageProfiler, repeat: int = 1):
+    """
+    Replays the recorded turns through the servicer and checks them against the trace.
+
+    A turn fails if the servicer reports FAILED, never reports FINISHED, or if the streamed tokens,
+    used sources or chat summary differ from the recorded ones. Failures are stored in
+    stage_profiler.failures.
+
+    Args:
+        turns (list[dict]): The recorded turns.
+        stage_profiler (StageProfiler): The profiler accounting every stage.
+        repeat (int, optional): How many times to replay the trace. Every repetition
+            uses fresh sessions. Defaults to 1.
+    """
+    replayer = Replayer()
+    servicer = ReplayServicerImpl(replayer, stage_profiler)
+    for iteration in range(repeat):
+        for turn in turns:
+            replayer.turn = turn
+            session = turn["session"] if iteration == 0 else f"{turn['session']}-{iteration}"
+            request = ConversationalRequest(session_uuid=session, input=turn["input"])
+            tokens = []
+            statuses = []
+            used_sources = []
+            for response in servicer.Conversational(request, None):
+                statuses.append(response.status)
+                match response.status:
+                    case ConversationalResponse.Status.GENERATE_RESPONSE:
+                        tokens.append(response.token)
+                    case ConversationalResponse.Status.FINISHED:
+                        used_sources = list(response.used_sources)
+
+            if ConversationalResponse.Status.FAILED in statuses:
+                stage_profiler.failures.append(f"{session}: servicer reported FAILED")
+            elif ConversationalResponse.Status.FINISHED not in statuses:
+                stage_profiler.failures.append(f"{session}: servicer never reported FINISHED")
+            elif tokens != turn["tokens"]:
+                stage_profiler.failures.append(f"{session}: streamed tokens differ from the trace")
+            elif used_sources != [result["source"] for result in turn["search_results"]]:
+                stage_profiler.failures.append(f"{session}: used sources differ from the trace")
+            elif servicer.memory_manager.get_chat_summary(session) != turn["summary"]:
+                stage_profiler.failures.append(f"{session}: chat summary differs from the trace")
+
+
+def run():
+    """Replay a trace file and print the per-stage breakdown."""
+    parser = argparse.ArgumentParser(description="Replay recorded conversations offline.")
+    parser.add_argument("trace", help="trace file recorded by the server (TRACE_FILE)")
+    parser.add_argument("--repeat", type=int, default=1, help="how many times to replay the trace")
+    parser.add_argument("--alloc", action="store_true", help="add a pass tracing allocations per stage")
+    parser.add_argument("--profile-dir", help="add a pass writing cProfile output per stage into this directory")
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    logging.basicConfig(level=logging.INFO)
+    turns = load_trace(args.trace)
+    if not turns:
+        parser.error(f"trace file {args.trace} contains no turns")
+    logging.info("Replaying %d turns %d time(s)", len(turns), args.repeat)
+
+    instrumentations = [StageProfiler.TIMING]
+    if args.alloc:
+        instrumentations.append(StageProfiler.ALLOC)
+    if args.profile_dir is not None:
+        instrumentations.append(StageProfiler.CPROFILE)
+
+    failed = False
+    for instrumentation in instrumentations:
+        stage_profiler = StageProfiler(instrumentation)
+        if instrumentation == StageProfiler.ALLOC:
+            tracemalloc.start()
+        replay(turns, stage_profiler, repeat=args.repeat)
+        if instrumentation == StageProfiler.ALLOC:
+            tracemalloc.stop()
+        if instrumentation == StageProfiler.CPROFILE:
+            stage_profiler.dump_profiles(args.profile_dir)
+            logging.info("Profiles written to %s", args.profile_dir)
+        print(stage_profiler)
+        failed = failed or bool(stage_profiler.failures)
+
+    if failed:
+        logging.error("Replay did not match the trace")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
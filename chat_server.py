@@ -7,6 +7,7 @@ import grpc
 from dotenv import load_dotenv
 
 from chat_servicer import ChatbotServicerImpl
+from core import TraceRecorder
 from chat_pb2_grpc import add_ChatbotServicer_to_server
 
 
@@ -28,13 +29,22 @@ def serve():
     if grpc_max_workers is None:
         logging.warning("GRPC_MAX_WORKERS is not set, using default value 10")
         grpc_max_workers = 10
+    trace_file = os.getenv("TRACE_FILE")
+    recorder = None
+    if trace_file:
+        logging.info("Recording conversations into %s", trace_file)
+        recorder = TraceRecorder(trace_file)
 
     server = grpc.server(futures.ThreadPoolExecutor(max_workers=int(grpc_max_workers)))
-    add_ChatbotServicer_to_server(ChatbotServicerImpl(openai_api_key, tavily_api_key), server)
+    add_ChatbotServicer_to_server(ChatbotServicerImpl(openai_api_key, tavily_api_key, recorder), server)
     server.add_insecure_port(f"[::]:{grpc_port}")
     server.start()
     logging.info("Server started at port %s", grpc_port)
-    server.wait_for_termination()
+    try:
+        server.wait_for_termination()
+    finally:
+        if recorder is not None:
+            recorder.close()
 
 
 serve()
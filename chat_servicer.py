@@ -1,4 +1,5 @@
 """This module holds the implementation of the ChatbotServicer class"""
+from contextlib import contextmanager
 import logging
 
 from colorama import Fore, Style
@@ -7,6 +8,7 @@ from langchain_community.retrievers.tavily_search_api import TavilySearchAPIRetr
 
 from core import MemoryManager
 from core import PromptEngine
+from core import TraceRecorder
 
 from chat_pb2_grpc import ChatbotServicer
 from chat_pb2 import ConversationalResponse
@@ -17,10 +19,11 @@ class ChatbotServicerImpl(ChatbotServicer):
     This class is the implementation of the ChatbotServicer class.
     """
 
-    def __init__(self, openai_api_key: str, tavily_api_key:str) -> None:
+    def __init__(self, openai_api_key: str, tavily_api_key:str, recorder: TraceRecorder | None = None) -> None:
         self.logger = logging.getLogger(self.__class__.__name__)
         self.openai_api_key = openai_api_key
         self.tavily_api_key = tavily_api_key
+        self.recorder = recorder
         self.memory_manager: MemoryManager | None = None
         self.prompt_engine: PromptEngine | None = None
 
@@ -29,23 +32,34 @@ class ChatbotServicerImpl(ChatbotServicer):
         # type: ignore
         return ChatOpenAI(api_key=openai_api_key, model="gpt-4-turbo-preview", streaming=True)
 
+    def _retriever_factory(self, tavily_api_key: str):
+        return TavilySearchAPIRetriever(api_key=tavily_api_key, k=5, search_depth=SearchDepth.ADVANCED)
+
+    @contextmanager
+    def _stage(self, name: str):
+        # Hook around the work of each pipeline stage. Does nothing by default;
+        # chat_replay.py overrides it to profile the stages.
+        yield
+
     def Conversational(self, request, context):
         session = request.session_uuid
         input_ = request.input
         llm = self._llm_factory(self.openai_api_key)
-        web_retriever = TavilySearchAPIRetriever(api_key=self.tavily_api_key, k=5, search_depth=SearchDepth.ADVANCED)
+        web_retriever = self._retriever_factory(self.tavily_api_key)
 
         yield ConversationalResponse(status=ConversationalResponse.Status.LOAD_HISTORY)
-        if self.memory_manager is None:
-            self.memory_manager = MemoryManager(llm=llm)
-        history = self.memory_manager.get_chat_history(session)
-        summary = self.memory_manager.get_chat_summary(session)
+        with self._stage("LOAD_HISTORY"):
+            if self.memory_manager is None:
+                self.memory_manager = MemoryManager(llm=llm)
+            history = self.memory_manager.get_chat_history(session)
+            summary = self.memory_manager.get_chat_summary(session)
 
         yield ConversationalResponse(status=ConversationalResponse.Status.WEB_SEARCH)
         try:
             search_query = "Chat summary:\n"+summary + "\nCurrent prompt: " + \
                 input_ if summary else "\nCurrent prompt: " + input_
-            web_search_results = web_retriever.invoke(input=search_query)
+            with self._stage("WEB_SEARCH"):
+                web_search_results = web_retriever.invoke(input=search_query)
         except Exception as e:
             self.logger.error("Failed on web search", exc_info=e)
             return (yield ConversationalResponse(status=ConversationalResponse.Status.FAILED))
@@ -56,15 +70,22 @@ class ChatbotServicerImpl(ChatbotServicer):
         yield ConversationalResponse(status=ConversationalResponse.Status.BUILD_PROMPT)
         if self.prompt_engine is None:
             self.prompt_engine = PromptEngine()
-        prompt = self.prompt_engine.generate_prompt(
-            input_=input_, history=history, summary=summary, web_resources=web_resources
-        )
+        with self._stage("BUILD_PROMPT"):
+            prompt = self.prompt_engine.generate_prompt(
+                input_=input_, history=history, summary=summary, web_resources=web_resources
+            )
         self.logger.debug("Generated prompt: \n%s%s%s%s",Fore.GREEN,Style.BRIGHT,prompt,Style.RESET_ALL)
         try:
-            response = ""
-            for token in llm.stream(input=prompt):
-                response += token.content  # type: ignore
+            tokens = []
+            stream = llm.stream(input=prompt)
+            while True:
+                with self._stage("GENERATE_RESPONSE"):
+                    token = next(stream, None)
+                if token is None:
+                    break
+                tokens.append(token.content)
                 yield ConversationalResponse(status=ConversationalResponse.Status.GENERATE_RESPONSE, token=token.content)  # type: ignore
+            response = "".join(tokens)  # type: ignore
         except Exception as e:
             self.logger.error("Failed on generating response", exc_info=e)
             return (yield ConversationalResponse(status=ConversationalResponse.Status.FAILED))
@@ -75,9 +96,26 @@ class ChatbotServicerImpl(ChatbotServicer):
                 {"role": MemoryManager.MessageRoles.HUMAN, "content": input_},
                 {"role": MemoryManager.MessageRoles.AI, "content": response},
             ]
-            self.memory_manager.append_to_memory(session, conversation_iteration)
+            with self._stage("UPDATE_MEMORY"):
+                self.memory_manager.append_to_memory(session, conversation_iteration)
+            new_summary = self.memory_manager.get_chat_summary(session) if self.recorder is not None else None
         except Exception as e:
             self.logger.error("Failed on updating memory", exc_info=e)
             return (yield ConversationalResponse(status=ConversationalResponse.Status.FAILED))
-        
+
         yield ConversationalResponse(status=ConversationalResponse.Status.FINISHED, used_sources=[result.metadata['source'] for result in web_search_results] if web_search_results else [])
+
+        if self.recorder is not None:
+            try:
+                self.recorder.record_turn(
+                    session=session,
+                    input_=input_,
+                    search_results=[
+                        {"source": result.metadata['source'], "content": result.page_content}
+                        for result in web_search_results
+                    ] if web_search_results else [],
+                    tokens=tokens,
+                    summary=new_summary or "",
+                )
+            except Exception as e:
+                self.logger.error("Failed on recording trace", exc_info=e)
@@ -4,3 +4,4 @@ This module provides the core functionality for the conversation tools.
 
 from .memory import MemoryManager, MessageRoles
 from .prompt import PromptEngine
+from .trace import TraceRecorder, load_trace
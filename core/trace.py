@@ -0,0 +1,90 @@
+"""
+This module provides recording and loading of conversation traces.
+
+A trace is a JSON Lines file where every line holds one conversation turn: the session,
+the user input, the web search results, the streamed LLM tokens and the chat summary
+produced after the turn. Traces can be replayed offline with `chat_replay.py`.
+
+Classes:
+- TraceRecorder: Appends conversation turns to a trace file.
+
+Functions:
+- load_trace: Loads the conversation turns stored in a trace file.
+"""
+
+import json
+import threading
+
+
+class TraceRecorder:
+    """
+    Appends conversation turns to a trace file.
+
+    Attributes:
+        _trace_file (TextIO): The trace file, opened for appending.
+        _lock (threading.Lock): Serializes writes coming from concurrent requests.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Initializes a new instance of the TraceRecorder class.
+
+        Args:
+            path (str): The path of the trace file. Turns are appended if the file exists.
+
+        Raises:
+            OSError: If the trace file cannot be opened.
+        """
+        self._trace_file = open(path, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+        self._lock = threading.Lock()
+
+    def record_turn(
+        self,
+        session: str,
+        input_: str,
+        search_results: list[dict[str, str]],
+        tokens: list[str],
+        summary: str,
+    ):
+        """
+        Appends a conversation turn to the trace file.
+
+        Args:
+            session (str): The session uuid of the conversation.
+            input_ (str): The user input.
+            search_results (list[dict[str, str]]): The web search results, each with a 'source' and 'content'.
+            tokens (list[str]): The tokens streamed by the LLM.
+            summary (str): The chat summary after the turn was saved into memory.
+        """
+        turn = {
+            "session": session,
+            "input": input_,
+            "search_results": search_results,
+            "tokens": tokens,
+            "summary": summary,
+        }
+        line = json.dumps(turn, ensure_ascii=False)
+        with self._lock:
+            self._trace_file.write(line + "\n")
+            self._trace_file.flush()
+
+    def close(self):
+        """
+        Closes the trace file.
+        """
+        with self._lock:
+            self._trace_file.close()
+
+
+def load_trace(path: str) -> list[dict]:
+    """
+    Loads the conversation turns stored in a trace file.
+
+    Args:
+        path (str): The path of the trace file.
+
+    Returns:
+        list[dict]: The recorded turns, in the order they were recorded.
+    """
+    with open(path, "r", encoding="utf-8") as trace_file:
+        return [json.loads(line) for line in trace_file if line.strip()]
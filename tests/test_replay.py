@@ -0,0 +1,51 @@
+"""Smoke tests for trace recording and offline replay."""
+
+import pytest
+
+pytest.importorskip("grpc")
+pytest.importorskip("langchain")
+pytest.importorskip("langchain_openai")
+pytest.importorskip("langchain_community")
+
+from chat_replay import StageProfiler, replay  # pylint: disable=wrong-import-position
+from core import TraceRecorder, load_trace  # pylint: disable=wrong-import-position
+
+
+def test_recorder_fails_on_unwritable_path(tmp_path):
+    with pytest.raises(OSError):
+        TraceRecorder(str(tmp_path / "missing" / "trace.jsonl"))
+
+
+def test_record_and_replay(tmp_path):
+    path = str(tmp_path / "trace.jsonl")
+    recorder = TraceRecorder(path)
+    recorder.record_turn(
+        session="session",
+        input_="Hello!",
+        search_results=[{"source": "https://example.com", "content": "An example page."}],
+        tokens=["Hi", " there", "!"],
+        summary="The human greets the AI.",
+    )
+    recorder.record_turn(
+        session="session",
+        input_="How are you?",
+        search_results=[],
+        tokens=["Fine", ", thanks."],
+        summary="The human greets the AI and asks how it is doing.",
+    )
+    recorder.close()
+
+    turns = load_trace(path)
+    assert len(turns) == 2
+
+    stage_profiler = StageProfiler()
+    replay(turns, stage_profiler, repeat=2)
+    assert stage_profiler.failures == []
+    assert set(stage_profiler.stats) == {
+        "LOAD_HISTORY",
+        "WEB_SEARCH",
+        "BUILD_PROMPT",
+        "GENERATE_RESPONSE",
+        "UPDATE_MEMORY",
+    }
+    assert stage_profiler.stats["GENERATE_RESPONSE"]["calls"] == 2 * (4 + 3)